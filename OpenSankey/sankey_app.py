@@ -13,10 +13,17 @@
 # ============================================================
 
 import streamlit as st
-import plotly.graph_objects as go
 import pandas as pd
-import yfinance as yf
-import io
+import numpy as np
+import hashlib
+import functools
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
 
 # ─────────────────────────────────────────────
 # PAGE CONFIG
@@ -48,6 +55,21 @@ div[data-testid="metric-container"] {
     background: #1e1e2e; border-radius: 12px;
     padding: 14px 18px; border: 1px solid #2d2d42;
 }
+/* Year selector (USA quick load) */
+.year-dropdown-container {
+    background: linear-gradient(135deg, #1e1e2e 0%, #2d2d42 100%);
+    border-radius: 16px; padding: 20px;
+    border: 1px solid #3d3d5c; margin: 10px 0;
+    box-shadow: 0 8px 32px rgba(0,0,0,0.3);
+}
+.year-dropdown-title {
+    font-size: 1.2rem; font-weight: 700; color: #e9d5ff;
+    margin-bottom: 12px; text-align: center;
+}
+.year-dropdown-subtitle {
+    font-size: 0.85rem; color: #9ca3af;
+    margin-bottom: 16px; text-align: center;
+}
 </style>
 """, unsafe_allow_html=True)
 
@@ -55,7 +77,8 @@ div[data-testid="metric-container"] {
 # ─────────────────────────────────────────────
 # CONSTANTS — SAMPLE DATA (NVDA FY2024 approx.)
 # ─────────────────────────────────────────────
-SAMPLE_DATA = {
+# Read-only view: shared across reruns and sessions without copying
+SAMPLE_DATA = MappingProxyType({
     "Total Revenue":          60922e6,
     "Cost of Revenue":        16621e6,
     "Gross Profit":           44301e6,
@@ -67,7 +90,16 @@ SAMPLE_DATA = {
     "Pretax Income":          33791e6,
     "Income Tax":              4042e6,
     "Net Income":             29760e6,
-}
+})
+
+INCOME_KEYS = (
+    "Total Revenue", "Cost of Revenue", "Gross Profit",
+    "R&D", "SG&A", "Other Operating Exp",
+    "Operating Income", "Interest Expense", "Pretax Income",
+    "Income Tax", "Net Income",
+)
+
+SCALE_DIVISORS = {"B": 1e9, "M": 1e6, "K": 1e3, "Raw": 1}
 
 THEMES = {
     "dark":   {"bg": "#0e1117", "font": "#ffffff", "grid": "#1f2937"},
@@ -77,6 +109,20 @@ THEMES = {
     "sunset": {"bg": "#1a0500", "font": "#fed7aa", "grid": "#2d1000"},
 }
 
+# Sankey topology: (source node, target node, palette color index), in draw order
+SANKEY_LINKS = (
+    ("Revenue",          "Cost of Revenue",  1),   # Col 1 → Col 2, goes UP
+    ("Revenue",          "Gross Profit",     2),   #                goes DOWN
+    ("Gross Profit",     "R&D",              3),   # Col 2 → Col 3, exits go UP
+    ("Gross Profit",     "SG&A",             4),
+    ("Gross Profit",     "Other OpEx",       5),
+    ("Gross Profit",     "Operating Income", 6),   #                Op Inc goes DOWN
+    ("Operating Income", "Interest Exp.",    7),   # Col 3 → Col 4, Interest goes UP
+    ("Operating Income", "Pretax Income",    8),   #                Pretax goes DOWN
+    ("Pretax Income",    "Income Tax",       9),   # Col 4 → Col 5, Tax above
+    ("Pretax Income",    "Net Income",       10),  #                Net Income below
+)
+
 NODE_PALETTES = {
     "vivid":   ["#22c55e","#ef4444","#3b82f6","#f59e0b","#f97316","#a855f7","#06b6d4","#64748b","#6366f1","#ec4899","#84cc16"],
     "pastel":  ["#86efac","#fca5a5","#93c5fd","#fcd34d","#fdba74","#d8b4fe","#67e8f9","#94a3b8","#a5b4fc","#f9a8d4","#bef264"],
@@ -92,94 +138,234 @@ def fmt(val, currency="$", scale="B"):
     """Format a number as a financial value string."""
     if val is None or (isinstance(val, float) and pd.isna(val)) or val == 0:
         return "—"
-    divisors = {"B": 1e9, "M": 1e6, "K": 1e3, "Raw": 1}
-    d = divisors.get(scale, 1e9)
+    d = SCALE_DIVISORS.get(scale, 1e9)
     return f"{currency}{val/d:.2f}{scale}"
 
 
+def yoy_pct(income, prev_income, keys=INCOME_KEYS):
+    """Percent change of every key vs. the comparison year, in one NumPy pass (NaN if no base)."""
+    curr = np.fromiter((income.get(k, 0) for k in keys), dtype=np.float64, count=len(keys))
+    prev = np.fromiter((prev_income.get(k, 0) for k in keys), dtype=np.float64, count=len(keys))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(prev != 0, (curr - prev) / np.abs(prev) * 100.0, np.nan)
+    return dict(zip(keys, pct.tolist()))
+
+
+@functools.lru_cache(maxsize=512)
+def rgba(hex_color, alpha=0.42):
+    """Convert '#rrggbb' to a Plotly 'rgba(r,g,b,a)' string."""
+    h = hex_color.lstrip("#")
+    r, g, b = int(h[0:2],16), int(h[2:4],16), int(h[4:6],16)
+    return f"rgba({r},{g},{b},{alpha})"
+
+
+# Translucent link colors, parsed once per palette
+PALETTE_RGBA = {name: [rgba(c) for c in colors] for name, colors in NODE_PALETTES.items()}
+
+
 def scale_val(val, scale="B"):
     """Convert raw value to scaled float."""
-    divisors = {"B": 1e9, "M": 1e6, "K": 1e3, "Raw": 1}
-    return val / divisors.get(scale, 1e9)
+    return val / SCALE_DIVISORS.get(scale, 1e9)
 
 
-def safe_row(df, candidates):
-    """Return the first matching row value from a DataFrame, by fuzzy index name."""
-    if df is None or df.empty:
+def _normalize(s):
+    """Case- and space-insensitive key used for fuzzy index matching."""
+    return s.lower().replace(" ", "")
+
+
+def index_map(df):
+    """Normalized index labels of df with their row positions, in index order: ((normalized, pos), …)."""
+    return tuple((_normalize(str(idx)), pos) for pos, idx in enumerate(df.index))
+
+
+def statement_matrix(df):
+    """Whole frame as one float64 array (NaN where missing), or None if any cell is non-numeric."""
+    try:
+        return df.to_numpy(dtype=np.float64, na_value=np.nan)
+    except (TypeError, ValueError):
         return None
-    for name in candidates:
-        for idx in df.index:
-            if name.lower().replace(" ", "") in str(idx).lower().replace(" ", ""):
-                row = df.loc[idx]
-                # Return first non-null column value
-                non_null = row.dropna()
-                if len(non_null) > 0:
-                    return row
-    return None
-
-
-def get_col(df, candidates, col_idx=0, default=0.0):
+
+
+def _match_row(df, candidates, idx_map=None, normalized=False, mat=None):
+    """First fuzzy-matched row that has data, as (row position, non-null float64 values)."""
+    if df is None or df.empty:
+        return None, None
+    if idx_map is None:
+        idx_map = index_map(df)
+    keys = candidates if normalized else map(_normalize, candidates)
+    for key in keys:
+        for norm, pos in idx_map:
+            if key in norm:
+                if mat is not None:
+                    vals = mat[pos]
+                else:
+                    try:
+                        vals = df.iloc[pos].to_numpy(dtype=np.float64, na_value=np.nan)
+                    except (TypeError, ValueError):
+                        # Non-numeric row: matched, but has no usable value
+                        return pos, np.empty(0)
+                vals = vals[~np.isnan(vals)]
+                if vals.size > 0:
+                    return pos, vals
+    return None, None
+
+
+def safe_row(df, candidates, idx_map=None):
+    """Return the first matching row value from a DataFrame, by fuzzy index name."""
+    pos, _ = _match_row(df, candidates, idx_map)
+    return None if pos is None else df.iloc[pos]
+
+
+def get_col(df, candidates, col_idx=0, default=0.0, idx_map=None, normalized=False, mat=None):
     """Get a single float value from a DataFrame row + column index."""
-    row = safe_row(df, candidates)
-    if row is None:
-        return default
-    try:
-        col_vals = row.dropna()
-        if col_idx < len(col_vals):
-            return float(col_vals.iloc[col_idx])
-        return default
-    except Exception:
+    _, vals = _match_row(df, candidates, idx_map, normalized, mat)
+    if vals is None or col_idx >= vals.size:
         return default
+    return float(vals[col_idx])
 
 
 # ─────────────────────────────────────────────
 # YAHOO FINANCE FETCH
 # ─────────────────────────────────────────────
-def fetch_ticker(symbol: str):
-    """Fetch income statement + company info from Yahoo Finance."""
-    try:
-        t = yf.Ticker(symbol)
-
-        # Try new API first, fall back to legacy
-        fin = None
-        for attr in ("income_stmt", "financials"):
-            try:
-                fin = getattr(t, attr)
-                if fin is not None and not fin.empty:
-                    break
-            except Exception:
-                pass
-
-        if fin is None or fin.empty:
-            return None, None, f"No income statement data found for '{symbol}'. Check the ticker symbol."
-
-        info = {}
+class FetchError(Exception):
+    """Raised inside the cached fetch so failures are never memoized."""
+
+
+def _ticker_income_stmt(t):
+    """Annual income statement for a yf.Ticker, or None (new API first, legacy fallback)."""
+    fin = None
+    for attr in ("income_stmt", "financials"):
         try:
-            info = t.info or {}
+            fin = getattr(t, attr)
+            if fin is not None and not fin.empty:
+                break
         except Exception:
             pass
+    return fin
+
+
+def _ticker_info(t) -> dict:
+    """Company profile for a yf.Ticker; empty dict if Yahoo has none."""
+    try:
+        return t.info or {}
+    except Exception:
+        return {}
+
+
+def business_summary(info: dict) -> str:
+    """Tab-3 company blurb, capped at 1000 characters; Yahoo may send None."""
+    summary = info.get("longBusinessSummary") or "No description available."
+    return summary[:1000] + ("…" if len(summary) > 1000 else "")
+
+
+def fiscal_year_labels(cols) -> list:
+    """Fiscal-year ("%Y") label per statement column; one vectorized call for a DatetimeIndex."""
+    if isinstance(cols, pd.DatetimeIndex):
+        return cols.strftime("%Y").tolist()
+    return [c.strftime("%Y") if hasattr(c, "strftime") else str(c) for c in cols]
+
+
+@st.cache_data(persist="disk", show_spinner=False, max_entries=64)
+def _fetch_ticker_cached(symbol: str):
+    """Cached Yahoo Finance download — one network round-trip per symbol per day.
 
-        return fin, info, None
+    Persisted to disk so restarts reuse the day's data. Keyed on the symbol alone (Streamlit
+    never prunes disk entries, so a per-day key would leave a file behind every day); the
+    fetch date travels with the value and fetch_ticker() replaces stale entries in place.
+    """
+    import yfinance as yf  # deferred: heavy import, only needed on a cache miss
+
+    t = yf.Ticker(symbol)
+
+    # info and the statement are separate HTTP calls — overlap them
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        info_future = pool.submit(_ticker_info, t)
+        fin = _ticker_income_stmt(t)
+        info = info_future.result()
+
+    if fin is None or fin.empty:
+        raise FetchError(f"No income statement data found for '{symbol}'. Check the ticker symbol.")
+
+    # Label columns by fiscal year once per fetch; year lists and tables reuse them
+    fin = fin.set_axis(fiscal_year_labels(fin.columns), axis=1)
+
+    # Tab-3 blurb, truncated once per fetch rather than on every rerun
+    info["_summary_trunc"] = business_summary(info)
+
+    return fin, info, date.today().isoformat()
 
+
+def fetch_ticker(symbol: str):
+    """Fetch income statement + company info from Yahoo Finance."""
+    symbol = symbol.upper()
+    try:
+        fin, info, fetched_on = _fetch_ticker_cached(symbol)
+        if fetched_on != date.today().isoformat():
+            # Yesterday's data: drop that entry (and its disk file), then refetch
+            _fetch_ticker_cached.clear(symbol)
+            fin, info, fetched_on = _fetch_ticker_cached(symbol)
+    except FetchError as e:
+        return None, None, str(e)
     except Exception as e:
         return None, None, f"Yahoo Finance error: {e}"
+    return fin, info, None
+
+
+QUICK_LOAD_SYMBOLS = ("NVDA", "AAPL", "MSFT", "GOOGL")
+
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def prefetch_defaults(symbols=QUICK_LOAD_SYMBOLS):
+    """Start downloading the quick-load tickers in parallel, without blocking the page."""
+    pool = ThreadPoolExecutor(max_workers=len(symbols))
+    futures = {sym: pool.submit(fetch_ticker, sym) for sym in symbols}
+    pool.shutdown(wait=False)
+    return futures
+
+
+def fetch_quick_load(symbol: str):
+    """Resolve a quick-load ticker from the prefetch pool, falling back to a direct fetch."""
+    fut = prefetch_defaults().get(symbol)
+    if fut is not None:
+        fin, info, err = fut.result()
+        if not err:
+            return fin, info, err
+    return fetch_ticker(symbol)
+
+
+# Yahoo row-name candidates per line item (INCOME_KEYS order), normalized once at import
+_FIELD_CANDIDATES = {
+    key: tuple(_normalize(name) for name in names)
+    for key, names in zip(INCOME_KEYS, (
+        ("Total Revenue", "Revenue"),
+        ("Cost Of Revenue", "Cost of Revenue", "Reconciled Cost Of Revenue"),
+        ("Gross Profit",),
+        ("Research And Development", "Research Development", "R&D"),
+        ("Selling General And Administration", "Selling General Administrative", "SGA"),
+        ("Other Operating Expense", "Other Operating Expenses"),
+        ("Operating Income", "Total Operating Income As Reported", "EBIT"),
+        ("Interest Expense",),
+        ("Pretax Income", "Income Before Tax"),
+        ("Tax Provision", "Income Tax Expense", "Income Tax"),
+        ("Net Income", "Net Income Common Stockholders"),
+    ))
+}
 
 
 def parse_income(fin, col_idx=0):
     """Extract key income statement line items from a yfinance DataFrame."""
-    g = lambda candidates: get_col(fin, candidates, col_idx)
-
-    revenue    = g(["Total Revenue", "Revenue"])
-    cogs       = g(["Cost Of Revenue", "Cost of Revenue", "Reconciled Cost Of Revenue"])
-    gross      = g(["Gross Profit"])
-    rd         = g(["Research And Development", "Research Development", "R&D"])
-    sga        = g(["Selling General And Administration", "Selling General Administrative", "SGA"])
-    other_opex = g(["Other Operating Expense", "Other Operating Expenses"])
-    op_income  = g(["Operating Income", "Total Operating Income As Reported", "EBIT"])
-    interest   = abs(g(["Interest Expense"]))
-    pretax     = g(["Pretax Income", "Income Before Tax", "Pretax Income"])
-    tax        = abs(g(["Tax Provision", "Income Tax Expense", "Income Tax"]))
-    net_income = g(["Net Income", "Net Income Common Stockholders"])
+    idx_map = index_map(fin) if fin is not None else ()
+    # One frame → ndarray conversion; each line item is then a row slice
+    mat = statement_matrix(fin) if fin is not None else None
+    values = (get_col(fin, cands, col_idx, idx_map=idx_map, normalized=True, mat=mat)
+              for cands in _FIELD_CANDIDATES.values())
+    return dict(zip(INCOME_KEYS, _complete_income(*values)))
+
+
+def _complete_income(revenue, cogs, gross, rd, sga, other_opex, op_income, interest, pretax, tax, net_income):
+    """Fill missing subtotals from their components and normalize signs (INCOME_KEYS order)."""
+    interest = abs(interest)
+    tax      = abs(tax)
 
     # Derived fallbacks
     if gross == 0 and revenue > 0:
@@ -191,25 +377,56 @@ def parse_income(fin, col_idx=0):
     if net_income == 0:
         net_income = pretax - tax
 
-    return {
-        "Total Revenue":      revenue,
-        "Cost of Revenue":    abs(cogs),
-        "Gross Profit":       abs(gross),
-        "R&D":                abs(rd),
-        "SG&A":               abs(sga),
-        "Other Operating Exp":abs(other_opex),
-        "Operating Income":   abs(op_income),
-        "Interest Expense":   abs(interest),
-        "Pretax Income":      abs(pretax),
-        "Income Tax":         abs(tax),
-        "Net Income":         abs(net_income),
-    }
+    return (revenue, abs(cogs), abs(gross), abs(rd), abs(sga), abs(other_opex),
+            abs(op_income), interest, abs(pretax), tax, abs(net_income))
+
+
+def frame_key(df) -> str:
+    """Short content hash of a DataFrame, computed once per fetch and used as a cache key."""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    return hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def _parse_income_cached(ticker: str, col_idx: int, fin_key: str, _fin) -> dict:
+    """parse_income memoized per (ticker, column); _fin is skipped by Streamlit's hasher."""
+    return parse_income(_fin, col_idx)
+
+
+def session_income(col_idx: int) -> dict:
+    """Income line items for the session's fetched DataFrame at column col_idx."""
+    ss = st.session_state
+    return _parse_income_cached(ss.ticker, col_idx, ss.fin_key, ss.fin)
+
+
+def commit_ticker(symbol: str, fin, info: dict, col_idx: int = 0):
+    """Make a fetched statement the session's active data (shared by sidebar fetch and quick-load)."""
+    ss = st.session_state
+    ss.fin       = fin
+    ss.fin_key   = frame_key(fin)
+    ss.info      = info
+    ss.ticker    = symbol
+    ss.year_opts = list(fin.columns)   # already fiscal-year labels
+    ss.income    = session_income(col_idx)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _raw_financials_table(fin_key: str, _fin) -> pd.DataFrame:
+    """All-years statement pre-formatted in billions, for the static Company Info table."""
+    disp = _fin.apply(pd.to_numeric, errors="coerce") / 1e9
+    return disp.apply(lambda col: col.map(lambda v: f"{v:,.2f} B" if pd.notna(v) else "—"))
 
 
 # ─────────────────────────────────────────────
 # SANKEY BUILDER  (column-per-stage, zero crossings)
 # ─────────────────────────────────────────────
-def build_sankey(data: dict, currency="$", scale="B", palette="vivid", title="Income Statement") -> go.Figure:
+def build_sankey(data: dict, currency="$", scale="B", palette="vivid", title="Income Statement") -> "go.Figure":
+    """Build the Sankey figure, memoized on the income values + display options."""
+    return _build_sankey_core(tuple(sorted(data.items())), currency, scale, palette, title)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _build_sankey_core(data_items: tuple, currency, scale, palette, title) -> "go.Figure":
     """
     Zero-crossing Sankey layout — each link only moves ONE column right.
 
@@ -224,15 +441,11 @@ def build_sankey(data: dict, currency="$", scale="B", palette="vivid", title="In
     continuing flow. Because every link goes only one column right and the
     vertical order is consistent, Bezier curves never cross.
     """
-    colors = NODE_PALETTES.get(palette, NODE_PALETTES["vivid"])
-
-    def rgba(hex_color, alpha=0.42):
-        h = hex_color.lstrip("#")
-        r, g, b = int(h[0:2],16), int(h[2:4],16), int(h[4:6],16)
-        return f"rgba({r},{g},{b},{alpha})"
+    colors      = NODE_PALETTES.get(palette, NODE_PALETTES["vivid"])
+    link_colors = PALETTE_RGBA.get(palette, PALETTE_RGBA["vivid"])
 
     # ── Extract & clamp values ────────────────────────────────────────
-    d      = data
+    d      = dict(data_items)
     rev    = max(d.get("Total Revenue",       0), 0)
     cogs   = max(d.get("Cost of Revenue",     0), 0)
     gross  = max(d.get("Gross Profit",        rev - cogs), 0)
@@ -319,34 +532,22 @@ def build_sankey(data: dict, currency="$", scale="B", palette="vivid", title="In
     node_y      = [n[4] for n in nodes]
 
     # ── Links (one column at a time, top→bottom order) ────────────────
-    srcs, tgts, vals, lcolors = [], [], [], []
-
-    def link(src, tgt, val, ci=0):
-        s, t = imap.get(src, -1), imap.get(tgt, -1)
-        if s >= 0 and t >= 0 and val > 0:
-            srcs.append(s); tgts.append(t)
-            vals.append(sv(val))
-            lcolors.append(rgba(colors[ci]))
-
-    # Col 1 → Col 2
-    link("Revenue",          "Cost of Revenue",  cogs,   1)   # goes UP
-    link("Revenue",          "Gross Profit",     gross,  2)   # goes DOWN
-
-    # Col 2 → Col 3  (exits go UP from Gross Profit, Op Inc goes DOWN)
-    if rd  > 0: link("Gross Profit", "R&D",             rd,     3)
-    if sga > 0: link("Gross Profit", "SG&A",            sga,    4)
-    if oo  > 0: link("Gross Profit", "Other OpEx",      oo,     5)
-    link("Gross Profit",     "Operating Income", op_inc, 6)   # goes DOWN
-
-    # Col 3 → Col 4  (Interest goes UP, Pretax goes DOWN)
-    if inter > 0: link("Operating Income", "Interest Exp.", inter, 7)
-    link("Operating Income", "Pretax Income",    pretax, 8)
-
-    # Col 4 → Col 5  (Tax slightly above, Net Income below)
-    if tax > 0: link("Pretax Income", "Income Tax", tax, 9)
-    link("Pretax Income",    "Net Income",        net,   10)
+    # Every link carries its target node's value; links to nodes that were
+    # not added (zero-valued exits) are masked out.
+    src_idx   = np.array([imap.get(src, -1) for src, _, _ in SANKEY_LINKS])
+    tgt_idx   = np.array([imap.get(tgt, -1) for _, tgt, _ in SANKEY_LINKS])
+    node_vals = np.array([n[1] for n in nodes], dtype=np.float64)
+    link_vals = np.where(tgt_idx >= 0, node_vals[tgt_idx], 0.0)
+    keep      = np.flatnonzero((src_idx >= 0) & (tgt_idx >= 0) & (link_vals > 0))
+
+    srcs    = src_idx[keep].tolist()
+    tgts    = tgt_idx[keep].tolist()
+    vals    = sv(link_vals[keep]).tolist()
+    lcolors = [link_colors[SANKEY_LINKS[i][2]] for i in keep]
 
     # ── Figure ────────────────────────────────────────────────────────
+    import plotly.graph_objects as go
+
     fig = go.Figure(go.Sankey(
         arrangement="fixed",
         node=dict(
@@ -376,9 +577,85 @@ def build_sankey(data: dict, currency="$", scale="B", palette="vivid", title="In
     return fig
 
 
+def sankey_json(data: dict, currency, scale, palette, title, bg, font_color, font_sz) -> str:
+    """Themed Sankey as Plotly JSON — the form both the chart and the exports consume."""
+    return _sankey_json_core(tuple(sorted(data.items())), currency, scale, palette, title,
+                             bg, font_color, font_sz)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _sankey_json_core(data_items: tuple, currency, scale, palette, title, bg, font_color, font_sz) -> str:
+    """Serialized once per (values, display options, theme); reruns reuse the string."""
+    fig = _build_sankey_core(data_items, currency, scale, palette, title)
+    fig.update_layout(
+        paper_bgcolor=bg,
+        font=dict(color=font_color, size=font_sz, family="Inter, Arial, sans-serif"),
+        title_font_color=font_color,
+    )
+    return fig.to_json()
+
+
+# ─────────────────────────────────────────────
+# EXPORT  (memoized on the figure's JSON)
+# ─────────────────────────────────────────────
+@st.cache_data(max_entries=16, show_spinner=False)
+def _fig_to_html(fig_json: str) -> bytes:
+    """Standalone HTML (Plotly.js from CDN) for a serialized figure, as UTF-8 bytes.
+
+    Encoded here so the cache holds a single bytes copy and download_button
+    can ship it as-is instead of re-encoding the str on every rerun.
+    """
+    import plotly.io as pio
+
+    return pio.from_json(fig_json).to_html(include_plotlyjs="cdn").encode("utf-8")
+
+
+@st.cache_resource(show_spinner=False)
+def get_kaleido_scope():
+    """Long-lived Kaleido renderer shared by all exports (None if the scopes API is missing)."""
+    try:
+        from kaleido.scopes.plotly import PlotlyScope
+    except ImportError:
+        return None
+    return PlotlyScope()
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _fig_to_image(fig_json: str, fmt: str, width: int, height: int, scale: int) -> bytes:
+    """Static PNG/SVG bytes for a serialized figure (requires kaleido)."""
+    import plotly.io as pio
+
+    fig = pio.from_json(fig_json)
+    scope = get_kaleido_scope()
+    if scope is not None:
+        try:
+            return scope.transform(fig, format=fmt, width=width, height=height, scale=scale)
+        except Exception:
+            pass
+    return pio.to_image(fig, format=fmt, width=width, height=height, scale=scale)
+
+
 # ─────────────────────────────────────────────
 # SIDEBAR
 # ─────────────────────────────────────────────
+def _fetch_sidebar_ticker(refresh: bool = False):
+    """on_click: fetch the sidebar ticker and commit it before the script reruns."""
+    symbol = st.session_state.ticker_input.upper().strip()
+    if not symbol:
+        return
+    if refresh:
+        _fetch_ticker_cached.clear()
+        prefetch_defaults.clear()
+    with st.spinner(f"Fetching {symbol} from Yahoo Finance…"):
+        fin, info, err = fetch_ticker(symbol)
+    if err:
+        st.session_state.fetch_msg = ("error", f"❌ {err}")
+        return
+
+    commit_ticker(symbol, fin, info)
+    st.session_state.fetch_msg = ("success", f"✅ Loaded {info.get('shortName', symbol)}")
+
+
 def sidebar():
     with st.sidebar:
         st.markdown("## 💹 OpenSankey")
@@ -387,10 +664,15 @@ def sidebar():
 
         # ── Fetch ──
         st.markdown("### 📈 Stock Data")
-        ticker_sym = st.text_input("Ticker Symbol", value="NVDA",
-                                   placeholder="AAPL, MSFT, NVDA …").upper().strip()
-        fetch_btn = st.button("🔄 Fetch from Yahoo Finance", type="primary",
-                              use_container_width=True)
+        # Fetching runs in on_click callbacks, so the sidebar below already
+        # renders the new ticker's years without a second script run.
+        st.text_input("Ticker Symbol", value="NVDA", key="ticker_input",
+                      placeholder="AAPL, MSFT, NVDA …")
+        st.button("🔄 Fetch from Yahoo Finance", type="primary",
+                  use_container_width=True, on_click=_fetch_sidebar_ticker)
+        st.button("♻️ Refresh", use_container_width=True,
+                  help="Discard cached Yahoo Finance data and re-download",
+                  on_click=_fetch_sidebar_ticker, kwargs=dict(refresh=True))
 
         st.divider()
 
@@ -419,7 +701,6 @@ def sidebar():
         exp_btn = st.button("⬇️ Export Diagram", use_container_width=True)
 
     return dict(
-        ticker=ticker_sym, fetch=fetch_btn,
         currency=currency, scale=scale,
         theme=theme, palette=palette, font_sz=font_sz,
         sel_year=sel_year, show_yoy=show_yoy,
@@ -430,44 +711,42 @@ def sidebar():
 # ─────────────────────────────────────────────
 # YEAR SELECTOR DROPDOWN (for USA mode)
 # ─────────────────────────────────────────────
+def _open_year_dropdown(ticker: str):
+    """on_click: show the year selector for a quick-load company."""
+    st.session_state.show_year_dropdown = ticker
+    # Start downloading the quick-load tickers while the user picks a year
+    prefetch_defaults()
+
+
+def _load_quick_ticker(ticker: str):
+    """on_click: fetch a quick-load company and commit it before the script reruns."""
+    selected_year = st.session_state[f"year_select_{ticker}"]
+    with st.spinner(f"Loading {ticker} data for {selected_year}..."):
+        fin, info, err = fetch_quick_load(ticker)
+    if err:
+        st.session_state.quick_load_msg = ("error", err)
+        return
+
+    # Find column index for selected year
+    col_idx = next((i for i, y in enumerate(fin.columns) if str(selected_year) in y), 0)
+
+    commit_ticker(ticker, fin, info, col_idx)
+    st.session_state.selected_usa_year = selected_year
+    st.session_state.selected_col_idx = col_idx
+    st.session_state.quick_load_msg = ("success", f"✅ Loaded {info.get('shortName', ticker)} — FY{selected_year}")
+
+
 def year_selector_dropdown(ticker: str, emoji: str):
     """Display a cool year selector dropdown for USA mode companies."""
     years = list(range(2016, 2026))  # 2016-2025
 
-    # Custom CSS for the dropdown
-    st.markdown("""
-    <style>
-    .year-dropdown-container {
-        background: linear-gradient(135deg, #1e1e2e 0%, #2d2d42 100%);
-        border-radius: 16px;
-        padding: 20px;
-        border: 1px solid #3d3d5c;
-        margin: 10px 0;
-        box-shadow: 0 8px 32px rgba(0,0,0,0.3);
-    }
-    .year-dropdown-title {
-        font-size: 1.2rem;
-        font-weight: 700;
-        color: #e9d5ff;
-        margin-bottom: 12px;
-        text-align: center;
-    }
-    .year-dropdown-subtitle {
-        font-size: 0.85rem;
-        color: #9ca3af;
-        margin-bottom: 16px;
-        text-align: center;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
     with st.container():
         st.markdown(f'<div class="year-dropdown-title">{emoji} {ticker}</div>', unsafe_allow_html=True)
         st.markdown('<div class="year-dropdown-subtitle">Select fiscal year to visualize (includes YoY data)</div>', unsafe_allow_html=True)
 
         col1, col2 = st.columns([3, 1])
         with col1:
-            selected_year = st.selectbox(
+            st.selectbox(
                 "Fiscal Year",
                 options=years,
                 index=len(years)-1,  # Default to 2025
@@ -475,35 +754,109 @@ def year_selector_dropdown(ticker: str, emoji: str):
                 label_visibility="collapsed"
             )
         with col2:
-            load_clicked = st.button("🚀 Load", key=f"load_{ticker}", type="primary", use_container_width=True)
+            st.button("🚀 Load", key=f"load_{ticker}", type="primary", use_container_width=True,
+                      on_click=_load_quick_ticker, args=(ticker,))
 
-        if load_clicked:
-            with st.spinner(f"Loading {ticker} data for {selected_year}..."):
-                fin, info, err = fetch_ticker(ticker)
-                if err:
-                    st.error(err)
-                else:
-                    st.session_state.fin = fin
-                    st.session_state.info = info
-                    st.session_state.ticker = ticker
-                    st.session_state.selected_usa_year = selected_year
+        msg = st.session_state.pop("quick_load_msg", None)
+        if msg:
+            kind, text = msg
+            (st.error if kind == "error" else st.success)(text)
+
+
+# ─────────────────────────────────────────────
+# KPI ROW & DIAGRAM  (fragments: rerun on their own)
+# ─────────────────────────────────────────────
+@st.fragment
+def render_kpis(income, yoy_chg, cur, sc):
+    """Headline metrics row with optional YoY deltas."""
+    m1, m2, m3, m4 = st.columns(4)
+
+    def delta_str(key):
+        pct = yoy_chg.get(key, np.nan)
+        return f"{pct:+.1f}% YoY" if np.isfinite(pct) else None
 
-                    # Build year list from column headers
-                    cols = list(fin.columns)
-                    years_avail = [c.strftime("%Y") if hasattr(c, "strftime") else str(c) for c in cols]
-                    st.session_state.year_opts = years_avail
+    m1.metric("Revenue",          fmt(income.get("Total Revenue",0),   cur, sc), delta_str("Total Revenue"))
+    m2.metric("Gross Profit",     fmt(income.get("Gross Profit",0),    cur, sc), delta_str("Gross Profit"))
+    m3.metric("Operating Income", fmt(income.get("Operating Income",0),cur, sc), delta_str("Operating Income"))
+    m4.metric("Net Income",       fmt(income.get("Net Income",0),      cur, sc), delta_str("Net Income"))
 
-                    # Find column index for selected year
-                    col_idx = 0
-                    for i, y in enumerate(years_avail):
-                        if str(selected_year) in y:
-                            col_idx = i
-                            break
 
-                    st.session_state.income = parse_income(fin, col_idx)
-                    st.session_state.selected_col_idx = col_idx
-                    st.success(f"✅ Loaded {info.get('shortName', ticker)} — FY{selected_year}")
-                    st.rerun()
+@st.fragment
+def render_sankey(income, title, ticker_label, cfg, th):
+    """Themed Sankey chart plus the export download button."""
+    import plotly.io as pio
+
+    fig_json = sankey_json(income, cfg["currency"], cfg["scale"], cfg["palette"], title,
+                           th["bg"], th["font"], cfg["font_sz"])
+    st.plotly_chart(pio.from_json(fig_json), use_container_width=True)
+
+    # Export
+    if cfg["exp_btn"]:
+        fmt_choice = cfg["exp_fmt"]
+        try:
+            if fmt_choice == "HTML":
+                data = _fig_to_html(fig_json)
+                st.download_button("📥 Download HTML", data=data,
+                                   file_name=f"{ticker_label}_sankey.html",
+                                   mime="text/html")
+            else:
+                try:
+                    img = _fig_to_image(fig_json, fmt_choice.lower(), 1400, 700, 2)
+                    st.download_button(f"📥 Download {fmt_choice}", data=img,
+                                       file_name=f"{ticker_label}_sankey.{fmt_choice.lower()}",
+                                       mime=f"image/{fmt_choice.lower()}")
+                except Exception:
+                    st.warning("⚠️ PNG/SVG requires kaleido: `pip install kaleido`. Exporting as HTML instead.")
+                    data = _fig_to_html(fig_json)
+                    st.download_button("📥 Download HTML", data=data,
+                                       file_name=f"{ticker_label}_sankey.html",
+                                       mime="text/html")
+        except Exception as e:
+            st.error(f"Export error: {e}")
+
+
+# ─────────────────────────────────────────────
+# HOW TO USE  (static; built once at import)
+# ─────────────────────────────────────────────
+HOWTO_MD = """
+## How to Use OpenSankey
+
+### 🚀 Quick Start
+1. Enter a **ticker symbol** in the left sidebar (e.g. `NVDA`, `AAPL`, `TSLA`)
+2. Click **Fetch from Yahoo Finance** — internet only needed here
+3. The Sankey diagram generates instantly in the **Sankey Diagram** tab
+
+### 🎨 Customize
+- **Currency / Scale** — Switch between $, €, B/M/K
+- **Theme** — Dark, Light, Ocean, Sunset, Purple
+- **Color Palette** — Vivid, Pastel, Neon, Mono
+- **Font Size** — Adjust node label size
+
+### 📋 Edit Data
+- Go to **Data Editor** tab to tweak any value
+- Paste directly from Excel or Google Sheets (click a cell → paste)
+- Click **Apply Edits** to regenerate the diagram
+
+### 💾 Export
+- **HTML** — Works everywhere, interactive, no install needed
+- **PNG/SVG** — Requires `pip install kaleido`
+
+### 📦 Dependencies
+```
+pip install streamlit plotly pandas yfinance kaleido
+```
+
+### 🔒 Privacy
+- All data processing is local
+- Yahoo Finance is only called when you click **Fetch** or a **Quick Load** company
+- Nothing is stored in the cloud
+"""
+
+
+@st.fragment
+def render_howto():
+    """Static usage guide for tab 4."""
+    st.markdown(HOWTO_MD)
 
 
 # ─────────────────────────────────────────────
@@ -511,7 +864,7 @@ def year_selector_dropdown(ticker: str, emoji: str):
 # ─────────────────────────────────────────────
 def main():
     # Session state init
-    for k, v in [("fin", None), ("info", {}), ("ticker", None),
+    for k, v in [("fin", None), ("fin_key", None), ("info", {}), ("ticker", None),
                  ("income", None), ("year_opts", ["Latest"]),
                  ("show_year_dropdown", None), ("selected_usa_year", None),
                  ("selected_col_idx", 0)]:
@@ -526,22 +879,10 @@ def main():
     st.divider()
 
     # ── Fetch ────────────────────────────────────────────────────────
-    if cfg["fetch"] and cfg["ticker"]:
-        with st.spinner(f"Fetching {cfg['ticker']} from Yahoo Finance…"):
-            fin, info, err = fetch_ticker(cfg["ticker"])
-        if err:
-            st.error(f"❌ {err}")
-        else:
-            st.session_state.fin    = fin
-            st.session_state.info   = info
-            st.session_state.ticker = cfg["ticker"]
-            # Build year list from column headers
-            cols = list(fin.columns)
-            years = [c.strftime("%Y") if hasattr(c, "strftime") else str(c) for c in cols]
-            st.session_state.year_opts = years
-            st.session_state.income    = parse_income(fin, 0)
-            st.success(f"✅ Loaded {info.get('shortName', cfg['ticker'])}")
-            st.rerun()
+    msg = st.session_state.pop("fetch_msg", None)
+    if msg:
+        kind, text = msg
+        (st.error if kind == "error" else st.success)(text)
 
     # ── Resolve selected year → income data ────────────────────────
     fin  = st.session_state.fin
@@ -555,12 +896,13 @@ def main():
             col_idx = yo.index(cfg["sel_year"])
             st.session_state.selected_col_idx = col_idx
 
-        income = parse_income(fin, col_idx)
+        income = session_income(col_idx)
         # YoY: get previous year data (col_idx + 1 since Yahoo data is newest first)
-        yoy    = parse_income(fin, col_idx + 1) if (cfg["show_yoy"] and col_idx + 1 < fin.shape[1]) else None
+        yoy    = session_income(col_idx + 1) if (cfg["show_yoy"] and col_idx + 1 < fin.shape[1]) else None
     else:
         income = st.session_state.income or SAMPLE_DATA
         yoy    = None
+    yoy_chg = yoy_pct(income, yoy) if yoy else {}
 
     th = THEMES[cfg["theme"]]
 
@@ -588,8 +930,8 @@ def main():
         company_clicks = {}
         for col, sym, emoji in [(c1,"NVDA","🟢"),(c2,"AAPL","🍎"),(c3,"MSFT","🪟"),(c4,"GOOGL","🔍")]:
             with col:
-                if st.button(f"{emoji} {sym}", use_container_width=True, key=f"btn_{sym}"):
-                    st.session_state.show_year_dropdown = sym
+                st.button(f"{emoji} {sym}", use_container_width=True, key=f"btn_{sym}",
+                          on_click=_open_year_dropdown, args=(sym,))
 
         # Show year selector dropdown if a company was clicked
         if st.session_state.show_year_dropdown:
@@ -603,20 +945,7 @@ def main():
         # KPI metrics row
         sc  = cfg["scale"]
         cur = cfg["currency"]
-        m1, m2, m3, m4 = st.columns(4)
-
-        def delta_str(key):
-            if yoy and yoy.get(key, 0):
-                prev = yoy[key]
-                curr = income.get(key, 0)
-                if prev:
-                    return f"{((curr - prev)/abs(prev)*100):+.1f}% YoY"
-            return None
-
-        m1.metric("Revenue",          fmt(income.get("Total Revenue",0),   cur, sc), delta_str("Total Revenue"))
-        m2.metric("Gross Profit",     fmt(income.get("Gross Profit",0),    cur, sc), delta_str("Gross Profit"))
-        m3.metric("Operating Income", fmt(income.get("Operating Income",0),cur, sc), delta_str("Operating Income"))
-        m4.metric("Net Income",       fmt(income.get("Net Income",0),      cur, sc), delta_str("Net Income"))
+        render_kpis(income, yoy_chg, cur, sc)
 
         st.divider()
 
@@ -633,37 +962,7 @@ def main():
             year_label = "FY2024 (approx.)"
         title = f"{ticker_label} · Income Statement · {year_label}"
 
-        fig = build_sankey(income, cur, sc, cfg["palette"], title)
-        fig.update_layout(
-            paper_bgcolor=th["bg"],
-            font=dict(color=th["font"], size=cfg["font_sz"], family="Inter, Arial, sans-serif"),
-            title_font_color=th["font"],
-        )
-        st.plotly_chart(fig, use_container_width=True)
-
-        # Export
-        if cfg["exp_btn"]:
-            fmt_choice = cfg["exp_fmt"]
-            try:
-                if fmt_choice == "HTML":
-                    data = fig.to_html(include_plotlyjs="cdn")
-                    st.download_button("📥 Download HTML", data=data,
-                                       file_name=f"{ticker_label}_sankey.html",
-                                       mime="text/html")
-                else:
-                    try:
-                        img = fig.to_image(format=fmt_choice.lower(), width=1400, height=700, scale=2)
-                        st.download_button(f"📥 Download {fmt_choice}", data=img,
-                                           file_name=f"{ticker_label}_sankey.{fmt_choice.lower()}",
-                                           mime=f"image/{fmt_choice.lower()}")
-                    except Exception:
-                        st.warning("⚠️ PNG/SVG requires kaleido: `pip install kaleido`. Exporting as HTML instead.")
-                        data = fig.to_html(include_plotlyjs="cdn")
-                        st.download_button("📥 Download HTML", data=data,
-                                           file_name=f"{ticker_label}_sankey.html",
-                                           mime="text/html")
-            except Exception as e:
-                st.error(f"Export error: {e}")
+        render_sankey(income, title, ticker_label, cfg, th)
 
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━
     # TAB 2 — DATA EDITOR
@@ -672,31 +971,27 @@ def main():
         st.subheader("📋 Income Statement Editor")
         st.caption("Edit any value directly, or paste from Excel/Google Sheets. Changes update the diagram.")
 
-        divisors = {"B": 1e9, "M": 1e6, "K": 1e3, "Raw": 1}
-        div = divisors.get(cfg["scale"], 1e9)
+        div = SCALE_DIVISORS.get(cfg["scale"], 1e9)
         sc  = cfg["scale"]
 
-        KEYS = [
-            "Total Revenue","Cost of Revenue","Gross Profit",
-            "R&D","SG&A","Other Operating Exp",
-            "Operating Income","Interest Expense","Pretax Income",
-            "Income Tax","Net Income",
-        ]
-
-        rows = []
-        for k in KEYS:
-            val  = income.get(k, 0)
-            row  = {"Metric": k, f"Current ({sc})": round(val / div, 3)}
-            if yoy:
-                prev = yoy.get(k, 0)
-                row[f"Prev Year ({sc})"] = round(prev / div, 3) if prev else 0
-                if prev:
-                    row["YoY %"] = f"{((val - prev)/abs(prev)*100):+.1f}%"
-                else:
-                    row["YoY %"] = "—"
-            rows.append(row)
+        KEYS = INCOME_KEYS
 
-        df = pd.DataFrame(rows)
+        # Build the editor column-wise: one scaled array per column, no per-row dicts
+        curr = np.fromiter((income.get(k, 0) for k in KEYS), dtype=np.float64, count=len(KEYS))
+        cols = {"Metric": KEYS, f"Current ({sc})": np.round(curr / div, 3)}
+        if yoy:
+            prev = np.fromiter((yoy.get(k, 0) for k in KEYS), dtype=np.float64, count=len(KEYS))
+            cols[f"Prev Year ({sc})"] = np.round(prev / div, 3)
+            cols["YoY %"] = pd.array([f"{p:+.1f}%" if np.isfinite(p) else "—"
+                                      for p in (yoy_chg.get(k, np.nan) for k in KEYS)],
+                                     dtype="string[pyarrow]")
+
+        df = pd.DataFrame(cols)
+        # Compact dtypes: smaller payload for the editor's Arrow round-trip and diffing.
+        # Metric stays plain text: it is editable, and a category column rejects new labels.
+        for c in (f"Current ({sc})", f"Prev Year ({sc})"):
+            if c in df:
+                df[c] = pd.to_numeric(df[c], downcast="float")
 
         col_cfg = {
             "Metric": st.column_config.TextColumn("Metric", width="medium"),
@@ -712,7 +1007,7 @@ def main():
         if st.button("🔄 Apply Edits → Update Diagram", type="primary"):
             new_income = {}
             for _, row in edited.iterrows():
-                new_income[row["Metric"]] = row[f"Current ({sc})"] * div
+                new_income[row["Metric"]] = round(float(row[f"Current ({sc})"]), 3) * div
             st.session_state.income = new_income
             st.success("✅ Updated! Go to the **Sankey Diagram** tab.")
 
@@ -751,18 +1046,12 @@ def main():
                 st.metric("EPS",        f"{cfg['currency']}{eps:.2f}" if eps else "—")
             with c2:
                 st.markdown("**Business Summary**")
-                summary = info.get("longBusinessSummary","No description available.")
-                st.write(summary[:1000] + ("…" if len(summary) > 1000 else ""))
+                st.write(info.get("_summary_trunc") or business_summary(info))
 
                 st.divider()
                 st.markdown("**Raw Financials (all years)**")
                 if fin is not None:
-                    # Show transposed for readability
-                    disp = fin.copy()
-                    disp.columns = [c.strftime("%Y") if hasattr(c,"strftime") else str(c) for c in disp.columns]
-                    st.dataframe(disp / 1e9, use_container_width=True,
-                                 column_config={c: st.column_config.NumberColumn(c, format="%.2f B")
-                                                for c in disp.columns})
+                    st.table(_raw_financials_table(st.session_state.fin_key, fin))
         else:
             st.info("👈 Fetch a ticker symbol to see company information here.")
 
@@ -770,39 +1059,7 @@ def main():
     # TAB 4 — HOW TO USE
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━
     with t4:
-        st.markdown("""
-## How to Use OpenSankey
-
-### 🚀 Quick Start
-1. Enter a **ticker symbol** in the left sidebar (e.g. `NVDA`, `AAPL`, `TSLA`)
-2. Click **Fetch from Yahoo Finance** — internet only needed here
-3. The Sankey diagram generates instantly in the **Sankey Diagram** tab
-
-### 🎨 Customize
-- **Currency / Scale** — Switch between $, €, B/M/K
-- **Theme** — Dark, Light, Ocean, Sunset, Purple
-- **Color Palette** — Vivid, Pastel, Neon, Mono
-- **Font Size** — Adjust node label size
-
-### 📋 Edit Data
-- Go to **Data Editor** tab to tweak any value
-- Paste directly from Excel or Google Sheets (click a cell → paste)
-- Click **Apply Edits** to regenerate the diagram
-
-### 💾 Export
-- **HTML** — Works everywhere, interactive, no install needed
-- **PNG/SVG** — Requires `pip install kaleido`
-
-### 📦 Dependencies
-```
-pip install streamlit plotly pandas yfinance kaleido
-```
-
-### 🔒 Privacy
-- All data processing is local
-- Yahoo Finance is only called when you click **Fetch**
-- Nothing is stored in the cloud
-        """)
+        render_howto()
 
     # Footer
     st.divider()
@@ -1,11 +1,12 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify
 import os
+import json
+import atexit
 import asyncio
+import base64
 import threading
 import re
 from datetime import datetime
-from playwright.async_api import async_playwright
-from PIL import Image
 
 app = Flask(__name__)
 
@@ -13,7 +14,75 @@ SAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "R.U.C. cons
 os.makedirs(SAVE_DIR, exist_ok=True)
 
 AVAILABLE_YEARS = ["2024", "2023", "2022", "2021", "2020"]
+RUC_PATTERN = re.compile(r"[0-9]{13}")
+ANNUAL_INFO_TEXT = re.compile(r"Informaci[oó]n anual presentada", re.I)
 captcha_storage = {}
+# Sorted /historial listing; reset when we create a file, and keyed on the
+# folder mtime so files added or deleted by hand are picked up too
+history_cache = {"files": None, "mtime": None}
+history_lock = threading.Lock()  # writers reset from Flask and worker threads
+# Notified when a CAPTCHA lands in captcha_storage; /captcha-events waits on it
+captcha_ready = threading.Condition()
+# /captcha-events pings this often, so a closed tab ends its stream
+KEEPALIVE_SECONDS = 15
+# BEFORE/AFTER click screenshots; off by default, AFTER is still kept when the click fails
+DEBUG_SCREENSHOTS = os.environ.get("DEBUG_SCREENSHOTS") == "1"
+CAPTCHA_TTL_SECONDS = 300  # unanswered CAPTCHAs give up and close their context
+MAX_CONCURRENT_RUNS = 5
+BUSY_MESSAGE = f"Ya hay {MAX_CONCURRENT_RUNS} consultas en proceso. Espera a que termine alguna."
+# Runs still automating or waiting on a CAPTCHA (slot -> ruc); a run frees its
+# slot once it only waits for the user to close Chrome
+busy_runs = {}
+runs_lock = threading.Lock()  # taken by Flask threads and the automation loop
+
+# One long-lived event loop runs every Playwright job, instead of a new
+# thread + asyncio.run() per RUC. Flask handlers hand coroutines to it.
+automation_loop = asyncio.new_event_loop()
+threading.Thread(target=automation_loop.run_forever, name="automation-loop", daemon=True).start()
+
+def run_in_automation_loop(coro):
+    return asyncio.run_coroutine_threadsafe(coro, automation_loop)
+
+# Chromium is launched once and shared; each RUC gets its own context.
+# HEADLESS=1 runs it without a window (the CAPTCHA is already shown in the web
+# page); by default Chrome stays visible so the user can check the result.
+HEADLESS = os.environ.get("HEADLESS") == "1"
+HEADLESS_ARGS = ["--disable-gpu", "--disable-dev-shm-usage", "--disable-extensions",
+                 "--disable-background-networking", "--disable-features=Translate,BackForwardCache"]
+playwright_driver = None
+shared_browser = None
+browser_lock = None  # created on automation_loop; on Python 3.9 a Lock binds to the loop current at creation
+
+async def get_browser():
+    global playwright_driver, shared_browser, browser_lock
+    if browser_lock is None:
+        browser_lock = asyncio.Lock()  # no await before this, so only one is ever made
+    async with browser_lock:
+        if shared_browser is None or not shared_browser.is_connected():
+            # First job, or the user quit Chrome: (re)launch
+            if playwright_driver is None:
+                # Imported on first use so the web UI starts without loading Playwright
+                from playwright.async_api import async_playwright
+                playwright_driver = await async_playwright().start()
+            shared_browser = await playwright_driver.chromium.launch(
+                headless=HEADLESS, args=HEADLESS_ARGS if HEADLESS else [])
+        return shared_browser
+
+async def close_browser():
+    if shared_browser is not None:
+        await shared_browser.close()
+    if playwright_driver is not None:
+        await playwright_driver.stop()
+
+@atexit.register
+def shutdown_automation():
+    try:
+        run_in_automation_loop(close_browser()).result(timeout=5)
+    except Exception:
+        pass
+
+def is_valid_ruc(ruc):
+    return RUC_PATTERN.fullmatch(ruc) is not None
 
 @app.route("/")
 def index():
@@ -25,19 +94,25 @@ def consultar():
     ruc = data.get("ruc", "").strip()
     year = data.get("year", "").strip()
     
-    if not ruc or len(ruc) != 13 or not ruc.isdigit():
+    if not is_valid_ruc(ruc):
         return jsonify({"success": False, "message": "RUC inválido"}), 400
     
     if not year or year not in AVAILABLE_YEARS:
         return jsonify({"success": False, "message": "Año inválido"}), 400
     
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    # Refuse before writing anything, so a rejected query leaves no file behind
+    if at_capacity():
+        return jsonify({"success": False, "message": BUSY_MESSAGE}), 429
+    
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
     filename = f"RUC_{ruc}_{year}_{timestamp}.txt"
     filepath = os.path.join(SAVE_DIR, filename)
     
     try:
         with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"R.U.C.: {ruc}\nAño: {year}\nFecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"R.U.C.: {ruc}\nAño: {year}\nFecha: {now.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        invalidate_history()
         return jsonify({"success": True, "message": "Guardado."})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -47,27 +122,61 @@ def consultar_supercias():
     data = request.get_json()
     ruc = data.get("ruc", "").strip()
     
-    if not ruc or len(ruc) != 13 or not ruc.isdigit():
+    if not is_valid_ruc(ruc):
         return jsonify({"success": False}), 400
     
-    thread = threading.Thread(target=run_supercias_async, args=(ruc,))
-    thread.daemon = True
-    thread.start()
+    slot = reserve_run(ruc)
+    if slot is None:
+        return jsonify({"success": False, "message": BUSY_MESSAGE}), 429
+    
+    run_in_automation_loop(automate_supercias(ruc, slot))
     
     return jsonify({"success": True})
 
-def run_supercias_async(ruc):
-    asyncio.run(automate_supercias(ruc))
+def at_capacity():
+    with runs_lock:
+        return len(busy_runs) >= MAX_CONCURRENT_RUNS
 
-async def automate_supercias(ruc):
-    p = await async_playwright().start()
-    browser = None
+def reserve_run(ruc):
+    # Check and claim under one lock, so two requests can't both take the last slot
+    with runs_lock:
+        if len(busy_runs) >= MAX_CONCURRENT_RUNS:
+            return None
+        slot = object()
+        busy_runs[slot] = ruc
+        return slot
+
+def release_run(slot):
+    with runs_lock:
+        busy_runs.pop(slot, None)
+    # Wake /captcha-events streams so they notice a run that ended early
+    with captcha_ready:
+        captcha_ready.notify_all()
+
+def run_alive(ruc):
+    with runs_lock:
+        return ruc in busy_runs.values()
+
+async def automate_supercias(ruc, slot):
+    context = None
+    captcha_entry = None
+    # One timestamp per run, shared by the status file and every screenshot
+    started = datetime.now()
+    run_started = started.strftime("%Y-%m-%d_%H-%M-%S")
+    stamp = started.strftime("%H%M%S")
+    # Status file of this run, rewritten in place (local, so overlapping runs of a RUC don't clash)
+    status_path = os.path.join(SAVE_DIR, f"RUC_{ruc}_SUPERCIAS_{run_started}.txt")
     
     try:
-        browser = await p.chromium.launch(headless=False)
+        browser = await get_browser()
         context = await browser.new_context(viewport={"width": 1280, "height": 800})
         page = await context.new_page()
         
+        # Set when the user closes the tab or quits Chrome
+        closed = asyncio.Event()
+        page.on("close", lambda _: closed.set())
+        context.on("close", lambda _: closed.set())
+        
         # Navigate and select RUC
         await page.goto("https://appscvsgen.supercias.gob.ec/consultaCompanias/societario/busquedaCompanias.jsf")
         await page.wait_for_load_state("networkidle")
@@ -75,12 +184,20 @@ async def automate_supercias(ruc):
         await asyncio.sleep(0.5)
         
         # Type RUC
-        ruc_input = await page.wait_for_selector('input[id*="parametroBusqueda_input"]')
+        # A locator (not an element handle) so the fallback can use press_sequentially
+        ruc_input = page.locator('input[id*="parametroBusqueda_input"]')
         await ruc_input.click()
         first_12 = ruc[:12]
-        for char in first_12:
-            await ruc_input.type(char, delay=250)
-        await asyncio.sleep(2)
+        # Fill in one call, then a real keystroke so the autocomplete's key listeners fire
+        await ruc_input.fill(first_12[:-1])
+        await ruc_input.press(first_12[-1])
+        try:
+            await page.wait_for_selector('.ui-autocomplete-item', timeout=5000)
+        except Exception:
+            # No suggestions yet: retype key by key and wait once more
+            await ruc_input.fill("")
+            await ruc_input.press_sequentially(first_12, delay=50)
+            await page.wait_for_selector('.ui-autocomplete-item', timeout=5000)
         
         # Select from dropdown
         dropdown_items = await page.query_selector_all('.ui-autocomplete-item')
@@ -96,176 +213,156 @@ async def automate_supercias(ruc):
         captcha_img = await page.wait_for_selector('img[src*="captcha"]')
         box = await captcha_img.bounding_box()
         
-        # Take full screenshot
-        full_screenshot = os.path.join(SAVE_DIR, f"full_{ruc}_{datetime.now().strftime('%H%M%S')}.png")
-        await page.screenshot(path=full_screenshot)
-        
-        # Crop CAPTCHA
-        captcha_path = os.path.join(SAVE_DIR, f"captcha_{ruc}_{datetime.now().strftime('%H%M%S')}.png")
-        img = Image.open(full_screenshot)
-        x, y = int(box['x'] - 10), int(box['y'] - 10)
-        w, h = int(box['width'] + 20), int(box['height'] + 20)
-        cropped = img.crop((max(0,x), max(0,y), x+w, y+h))
-        cropped.save(captcha_path)
+        # Screenshot just the CAPTCHA (+10px margin); Chromium crops it
+        captcha_path = os.path.join(SAVE_DIR, f"captcha_{ruc}_{stamp}.png")
+        x, y = max(0, box['x'] - 10), max(0, box['y'] - 10)
+        clip = {"x": x, "y": y,
+                "width": box['x'] + box['width'] + 10 - x,
+                "height": box['y'] + box['height'] + 10 - y}
+        captcha_png = await page.screenshot(path=captcha_path, clip=clip)
         
         # Find the CAPTCHA input field
         captcha_input = await page.wait_for_selector('input[id*="captcha"]')
         
-        # Store captcha info
-        captcha_storage[ruc] = {
-            "path": captcha_path,
-            "page": page,
-            "captcha_input": captcha_input,
-            "submitted": False,
-            "code": None,
-            "status": "waiting"
+        # Publish what the endpoints need; page handles stay in this coroutine
+        codes = asyncio.Queue(maxsize=1)
+        captcha_entry = captcha_storage[ruc] = {
+            # Encoded once; sent inline so the page needs no second request
+            "image": base64.b64encode(captcha_png).decode("ascii"),
+            "status": "waiting",
+            "queue": codes
         }
         
-        await save_status(ruc, "CAPTCHA capturado - esperando que el usuario lo escriba")
+        with captcha_ready:
+            captcha_ready.notify_all()
         
-        # Wait for user to submit captcha
-        while captcha_storage[ruc]["status"] != "submitted":
-            await asyncio.sleep(0.5)
+        await save_status(status_path, ruc, "CAPTCHA capturado - esperando que el usuario lo escriba")
+        
+        # Wait for user to submit captcha (pushed by /submit-captcha)
+        try:
+            captcha_code = await asyncio.wait_for(codes.get(), timeout=CAPTCHA_TTL_SECONDS)
+        except asyncio.TimeoutError:
+            await save_status(status_path, ruc, "CAPTCHA expirado - no se recibió el código a tiempo")
+            return
         
         # Type captcha and submit
-        captcha_code = captcha_storage[ruc]["code"]
         await captcha_input.fill(captcha_code)
         await asyncio.sleep(0.5)
         
         # Click submit
         await page.click('button[id*="consultar"]')
-        await save_status(ruc, f"CAPTCHA enviado - esperando página de compañía...")
+        await save_status(status_path, ruc, f"CAPTCHA enviado - esperando página de compañía...")
         
         # Wait for company page
         await asyncio.sleep(6)
         await page.wait_for_load_state("networkidle")
         
-        # SCREENSHOT BEFORE CLICK
-        before_click = os.path.join(SAVE_DIR, f"BEFORE_CLICK_{ruc}_{datetime.now().strftime('%H%M%S')}.png")
-        await page.screenshot(path=before_click)
-        await save_status(ruc, f"Página cargada. Screenshot ANTES del clic guardado.")
+        # SCREENSHOT BEFORE CLICK (debug only)
+        if DEBUG_SCREENSHOTS:
+            before_click = os.path.join(SAVE_DIR, f"BEFORE_CLICK_{ruc}_{stamp}.png")
+            await page.screenshot(path=before_click)
+            await save_status(status_path, ruc, f"Página cargada. Screenshot ANTES del clic guardado.")
+        else:
+            await save_status(status_path, ruc, "Página cargada.")
         
-        # Try to click "Información anual presentada"
+        # Click "Información anual presentada" (the locator auto-waits and retries)
         clicked = False
         click_method = ""
-        
-        # Method 1: Try direct text selector
         try:
-            element = await page.wait_for_selector('text=Información anual presentada', timeout=5000)
-            if element:
-                await element.scroll_into_view_if_needed()
-                await asyncio.sleep(1)
-                await element.click()
-                clicked = True
-                click_method = "text selector"
-        except:
+            # click() scrolls into view itself, so the whole attempt is bounded by one 8s timeout
+            await page.get_by_text(ANNUAL_INFO_TEXT).first.click(timeout=8000)
+            clicked = True
+            click_method = "locator"
+        except Exception:
             pass
         
-        # Method 2: Try without accent
-        if not clicked:
-            try:
-                element = await page.wait_for_selector('text=Informacion anual presentada', timeout=3000)
-                if element:
-                    await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(1)
-                    await element.click()
-                    clicked = True
-                    click_method = "text sin acento"
-            except:
-                pass
-        
-        # Method 3: Search all elements
-        if not clicked:
-            try:
-                all_elements = await page.query_selector_all('*')
-                for el in all_elements:
-                    try:
-                        text = await el.text_content()
-                        if text and "informacion anual" in text.lower().replace("ó", "o"):
-                            await el.scroll_into_view_if_needed()
-                            await asyncio.sleep(1)
-                            await el.click()
-                            clicked = True
-                            click_method = f"elemento con texto: {text[:30]}"
-                            break
-                    except:
-                        continue
-            except:
-                pass
-        
-        # Method 4: JavaScript click
-        if not clicked:
-            try:
-                result = await page.evaluate('''() => {
-                    const elements = document.querySelectorAll('*');
-                    for (let el of elements) {
-                        if (el.textContent && el.textContent.toLowerCase().includes('informacion anual')) {
-                            el.scrollIntoView({behavior: 'smooth', block: 'center'});
-                            setTimeout(() => el.click(), 500);
-                            return 'Clicked via JS: ' + el.tagName + ' - ' + el.textContent.substring(0, 50);
-                        }
-                    }
-                    return 'Not found';
-                }''')
-                if 'Clicked' in result:
-                    clicked = True
-                    click_method = result
-            except:
-                pass
-        
         # Wait and take screenshot AFTER click
         await asyncio.sleep(5)
         await page.wait_for_load_state("networkidle")
         
-        after_click = os.path.join(SAVE_DIR, f"AFTER_CLICK_{ruc}_{datetime.now().strftime('%H%M%S')}.png")
-        await page.screenshot(path=after_click)
+        # Headless runs have no window to look at, so always keep the result
+        if DEBUG_SCREENSHOTS or HEADLESS or not clicked:
+            after_click = os.path.join(SAVE_DIR, f"AFTER_CLICK_{ruc}_{stamp}.png")
+            await page.screenshot(path=after_click)
         
         if clicked:
-            await save_status(ruc, f"✅ CLICK REALIZADO ({click_method}) - Revisa los screenshots BEFORE/AFTER")
+            await save_status(status_path, ruc, f"✅ CLICK REALIZADO ({click_method})")
         else:
-            await save_status(ruc, f"⚠️ NO SE PUDO HACER CLICK - Revisa screenshot BEFORE_CLICK para ver el estado")
+            await save_status(status_path, ruc, f"⚠️ NO SE PUDO HACER CLICK - Revisa screenshot AFTER_CLICK para ver el estado")
         
-        # Keep browser open - user closes manually
-        await save_status(ruc, f"✅ PROCESO TERMINADO - Chrome permanece abierto. Revisa los screenshots en 'R.U.C. consultados/'")
-        
-        # Wait until user closes browser
-        try:
-            while True:
-                await page.title()
-                await asyncio.sleep(3)
-        except:
-            pass
+        if HEADLESS:
+            await save_status(status_path, ruc, "✅ PROCESO TERMINADO - Revisa el screenshot AFTER_CLICK.")
+        else:
+            # Keep browser open - user closes manually
+            await save_status(status_path, ruc, f"✅ PROCESO TERMINADO - Chrome permanece abierto.")
+            
+            # Only the user is left to act, so this run no longer counts
+            release_run(slot)
+            # Wait until user closes browser
+            await closed.wait()
         
     except Exception as e:
-        await save_status(ruc, f"Error: {str(e)}")
+        await save_status(status_path, ruc, f"Error: {str(e)}")
     finally:
-        if ruc in captcha_storage:
+        release_run(slot)
+        # Only drop our own entry; a newer run of the same RUC may own it now
+        if captcha_entry is not None and captcha_storage.get(ruc) is captcha_entry:
             del captcha_storage[ruc]
-        if browser:
-            await browser.close()
-        await p.stop()
+        if context:
+            try:
+                await context.close()
+            except Exception:
+                pass  # Chrome already closed by the user
 
-async def save_status(ruc, status):
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = f"RUC_{ruc}_SUPERCIAS_{timestamp}.txt"
-    filepath = os.path.join(SAVE_DIR, filename)
+def write_text(filepath, text):
     with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"R.U.C.: {ruc}\nFecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\nEstado: {status}\n")
+        f.write(text)
+
+async def save_status(filepath, ruc, status):
+    # One file per run: each status overwrites the previous one
+    text = f"R.U.C.: {ruc}\nFecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\nEstado: {status}\n"
+    # Disk I/O off the automation loop so other runs keep going
+    await asyncio.to_thread(write_text, filepath, text)
+    invalidate_history()
+
+def invalidate_history():
+    with history_lock:
+        history_cache["files"] = None
 
 @app.route("/captcha-status/<ruc>", methods=["GET"])
 def captcha_status(ruc):
     if ruc in captcha_storage:
-        return jsonify({
-            "ready": True,
-            "status": captcha_storage[ruc]["status"]
-        })
+        entry = captcha_storage[ruc]
+        payload = {"ready": True, "status": entry["status"]}
+        if entry["status"] == "waiting":
+            payload["image"] = entry["image"]
+        return jsonify(payload)
     return jsonify({"ready": False})
 
-@app.route("/captcha-image/<ruc>", methods=["GET"])
-def captcha_image(ruc):
-    if ruc in captcha_storage and os.path.exists(captcha_storage[ruc]["path"]):
-        return send_file(captcha_storage[ruc]["path"], mimetype='image/png')
-    return jsonify({"error": "CAPTCHA not found"}), 404
+@app.route("/captcha-events/<ruc>", methods=["GET"])
+def captcha_events(ruc):
+    # Server-Sent Events: hold the request open and push once the CAPTCHA is ready
+    def waiting_entry():
+        # Only a CAPTCHA still waiting for its code counts, not an old "submitted" run
+        entry = captcha_storage.get(ruc)
+        return entry if entry is not None and entry["status"] == "waiting" else None
+    
+    def stream():
+        # Open for as long as the run is alive; a keep-alive write to a closed
+        # tab raises, which ends this generator and frees the thread
+        while True:
+            with captcha_ready:
+                captcha_ready.wait_for(lambda: waiting_entry() or not run_alive(ruc), timeout=KEEPALIVE_SECONDS)
+                entry = waiting_entry()
+            if entry:
+                yield f"data: {json.dumps({'status': entry['status'], 'image': entry['image']})}\n\n"
+                return
+            if not run_alive(ruc):
+                yield "event: ended\ndata: {}\n\n"
+                return
+            yield ": keep-alive\n\n"
+    
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.route("/submit-captcha", methods=["POST"])
 def submit_captcha():
@@ -279,16 +376,28 @@ def submit_captcha():
     if not captcha_code:
         return jsonify({"success": False, "message": "Código vacío"}), 400
     
-    captcha_storage[ruc]["code"] = captcha_code
+    if captcha_storage[ruc]["status"] == "submitted":
+        return jsonify({"success": False, "message": "CAPTCHA ya enviado"}), 409
+    
     captcha_storage[ruc]["status"] = "submitted"
+    # Hand the code to the waiting automation; asyncio.Queue is not thread-safe
+    automation_loop.call_soon_threadsafe(captcha_storage[ruc]["queue"].put_nowait, captcha_code)
     
     return jsonify({"success": True, "message": "CAPTCHA recibido, procesando..."})
 
 @app.route("/historial", methods=["GET"])
 def historial():
     try:
-        files = [f for f in os.listdir(SAVE_DIR) if f.endswith('.txt')]
-        files.sort(reverse=True)
+        # Held across the refresh so a reset can't land between the listing and storing it
+        with history_lock:
+            mtime = os.stat(SAVE_DIR).st_mtime_ns
+            if history_cache["files"] is None or history_cache["mtime"] != mtime:
+                # scandir hands back the stat info with each entry; newest first
+                with os.scandir(SAVE_DIR) as it:
+                    entries = [(e.stat().st_mtime_ns, e.name) for e in it if e.name.endswith('.txt')]
+                entries.sort(reverse=True)
+                history_cache["files"], history_cache["mtime"] = [name for _, name in entries], mtime
+            files = history_cache["files"]
         return jsonify({"success": True, "files": files})
     except Exception as e:
         return jsonify({"success": False}), 500
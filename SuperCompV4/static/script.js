@@ -13,7 +13,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let isSubmitting = false;
     let currentRuc = null;
-    let captchaCheckInterval = null;
+    let captchaEvents = null;
 
     // Check if form is valid
     function checkFormValidity() {
@@ -115,19 +115,28 @@ document.addEventListener('DOMContentLoaded', () => {
             const localData = await localResponse.json();
 
             if (!localData.success) {
-                showStatus('Error al guardar.', 'error');
+                showStatus(localData.message || 'Error al guardar.', 'error');
                 isSubmitting = false;
                 consultarBtn.classList.remove('loading');
                 checkFormValidity();
                 return;
             }
 
-            // Step 2: Start Supercias automation
-            fetch('/consultar-supercias', {
+            // Step 2: Start Supercias automation (the stream needs the run registered first)
+            const runResponse = await fetch('/consultar-supercias', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ ruc }),
             });
+            const runData = await runResponse.json();
+
+            if (!runData.success) {
+                showStatus(runData.message || 'No se pudo iniciar la consulta.', 'error');
+                isSubmitting = false;
+                consultarBtn.classList.remove('loading');
+                checkFormValidity();
+                return;
+            }
 
             // Show waiting for CAPTCHA message
             showStatus('Chrome abierto. Esperando CAPTCHA...', 'info');
@@ -142,33 +151,36 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function startCaptchaCheck(ruc) {
-        // Clear any existing interval
-        if (captchaCheckInterval) {
-            clearInterval(captchaCheckInterval);
+        // Close any existing stream
+        if (captchaEvents) {
+            captchaEvents.close();
         }
         
-        // Check every second if CAPTCHA is ready
-        captchaCheckInterval = setInterval(async () => {
-            try {
-                const response = await fetch(`/captcha-status/${ruc}`);
-                const data = await response.json();
-                
-                if (data.ready && data.status === 'waiting') {
-                    clearInterval(captchaCheckInterval);
-                    showCaptchaInput(ruc);
-                }
-            } catch (e) {
-                console.error('Error checking captcha status:', e);
+        // The server pushes a single event once the CAPTCHA is ready, or 'ended'
+        // if the run stops first; dropped connections reconnect on their own
+        captchaEvents = new EventSource(`/captcha-events/${ruc}`);
+        captchaEvents.onmessage = (e) => {
+            const data = JSON.parse(e.data);
+            if (data.status === 'waiting') {
+                captchaEvents.close();
+                showCaptchaInput(ruc, data.image);
             }
-        }, 1000);
+        };
+        captchaEvents.addEventListener('ended', () => {
+            captchaEvents.close();
+            showStatus('No se pudo obtener el CAPTCHA. Revisa el historial e intenta de nuevo.', 'error');
+            isSubmitting = false;
+            consultarBtn.classList.remove('loading');
+            checkFormValidity();
+        });
     }
 
-    function showCaptchaInput(ruc) {
+    function showCaptchaInput(ruc, image) {
         // Create CAPTCHA input UI
         const captchaHtml = `
             <div class="captcha-section">
                 <p class="captcha-text">Por favor escribe el CAPTCHA que ves en Chrome:</p>
-                <img src="/captcha-image/${ruc}" alt="CAPTCHA" class="captcha-img">
+                <img src="data:image/png;base64,${image}" alt="CAPTCHA" class="captcha-img">
                 <div class="captcha-input-group">
                     <input type="text" id="captcha-input" placeholder="Escribe el CAPTCHA..." maxlength="10" autocomplete="off">
                     <button id="captcha-submit" class="captcha-btn">Enviar</button>